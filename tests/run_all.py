@@ -2,43 +2,148 @@
 """
 Run the full test suite for luau-qrgen.
 
-This runs:
+This runs, concurrently:
 1) Luau unit tests (tests/testQrgen.luau)
 2) Python verification tests (tests/test_runner.py)
 
-Runs the test suite once and exits with the combined result.
+Each output line is tagged with the suite it came from. Runs the test suite
+once and exits with the combined result. Pass --max-attempts to retry a
+failing run a bounded number of times; retries only re-run the suite that
+failed, and only the Python test cases that failed when they can be identified.
 """
 
 from __future__ import annotations
 
+import argparse
+import re
 import subprocess
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 ROOT_DIR = Path(__file__).resolve().parent.parent
 
 
-def run_command(name: str, command: list[str]) -> bool:
-    print(f"\n=== {name} ===")
-    result = subprocess.run(command, cwd=str(ROOT_DIR))
-    if result.returncode != 0:
-        print(f"{name} failed with exit code {result.returncode}")
-        return False
-    return True
+# Matches the per-case status lines printed by tests/test_runner.py
+FAIL_LINE = re.compile(r"^\[FAIL\]: (\S+) - ")
 
+# Both suites print from their own thread, keep their lines whole
+PRINT_LOCK = threading.Lock()
 
-def run_all_once() -> bool:
-    if not run_command("Luau tests", ["lune", "run", "tests/testQrgen.luau"]):
-        return False
-    if not run_command("Python tests", [sys.executable, "tests/test_runner.py"]):
-        return False
-    return True
+
+def tagged_print(name: str, line: str) -> None:
+    with PRINT_LOCK:
+        print(f"[{name}] {line}", end="" if line.endswith("\n") else "\n", flush=True)
+
+
+def run_command(name: str, command: list[str]) -> tuple[bool, list[str]]:
+    process = subprocess.Popen(
+        command,
+        cwd=str(ROOT_DIR),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        encoding="utf-8",
+        errors="replace",
+    )
+    assert process.stdout is not None
+
+    # Echo the output as it arrives while keeping it for the caller
+    output = []
+    for line in process.stdout:
+        tagged_print(name, line)
+        output.append(line)
+
+    returncode = process.wait()
+    if returncode != 0:
+        tagged_print(name, f"failed with exit code {returncode}")
+        return False, output
+    return True, output
+
+
+def run_all_once(
+    runner_args: list[str],
+    run_luau: bool = True,
+    run_python: bool = True,
+    test_cases: list[str] | None = None,
+) -> tuple[bool, bool, list[str]]:
+    """Run the suites side by side.
+
+    Returns whether the Luau and Python suites passed (a skipped suite counts
+    as passed) and which Python test cases failed.
+    """
+    luau_command = ["lune", "run", "tests/testQrgen.luau"]
+    # -u so its output streams through the pipe instead of arriving in one burst at exit
+    python_command = [sys.executable, "-u", "tests/test_runner.py", *runner_args]
+    if test_cases:
+        python_command += ["--test-name", *test_cases]
+
+    # The suites are independent, so the wall time is the slower of the two
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        luau = executor.submit(run_command, "Luau tests", luau_command) if run_luau else None
+        python = executor.submit(run_command, "Python tests", python_command) if run_python else None
+
+        luau_passed = luau.result()[0] if luau else True
+        python_passed, output = python.result() if python else (True, [])
+
+    failed = [match.group(1) for line in output if (match := FAIL_LINE.match(line))]
+    return luau_passed, python_passed, failed
 
 
 def main() -> int:
-    if run_all_once():
-        print("\nAll tests passed.")
-        return 0
+    parser = argparse.ArgumentParser(description="Run the full luau-qrgen test suite")
+    parser.add_argument(
+        "--save-artifacts",
+        action="store_true",
+        help="Save images and SVGs for every Python test case, not just failing ones",
+    )
+    parser.add_argument(
+        "--debug-artifacts",
+        action="store_true",
+        help="Save the JSON exchanged with Lune for every Python test case",
+    )
+    parser.add_argument(
+        "--max-attempts",
+        type=int,
+        default=1,
+        help="Run the suite up to this many times until it passes (default: 1)",
+    )
+    parser.add_argument(
+        "--delay",
+        type=float,
+        default=0.0,
+        help="Seconds to wait between attempts (default: 0)",
+    )
+    args = parser.parse_args()
+    if args.max_attempts < 1:
+        parser.error("--max-attempts must be at least 1")
+
+    runner_args: list[str] = []
+    if args.save_artifacts:
+        runner_args.append("--save-artifacts")
+    if args.debug_artifacts:
+        runner_args.append("--debug-artifacts")
+    run_luau = run_python = True
+    failed: list[str] = []
+    for attempt in range(1, args.max_attempts + 1):
+        if attempt > 1:
+            scope = []
+            if run_luau:
+                scope.append("Luau tests")
+            if run_python:
+                scope.append(", ".join(failed) if failed else "Python tests")
+            print(f"\nRetrying (attempt {attempt}/{args.max_attempts}): {'; '.join(scope)}")
+            time.sleep(args.delay)
+
+        luau_passed, python_passed, failed = run_all_once(runner_args, run_luau, run_python, failed)
+        if luau_passed and python_passed:
+            print("\nAll tests passed.")
+            return 0
+
+        # Only repeat what failed
+        run_luau, run_python = not luau_passed, not python_passed
 
     print("\nTests failed.")
     return 1
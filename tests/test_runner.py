@@ -6,25 +6,33 @@ This tool compares the output of the Luau QR code library against a reference
 implementation (qrcode library) and verifies that generated QR codes are scannable.
 
 Usage:
-    python test_runner.py [--verbose] [--test-case TEST_CASE]
+    python test_runner.py [--verbose] [--test-case TEST_CASE ...] [--test-name NAME ...] [--parallel N] [--save-artifacts] [--debug-artifacts]
 
 Requirements:
-    pip install qrcode pillow pyzbar
+    pip install qrcode pillow numpy pyzbar orjson
 """
 
 import argparse
+import functools
+import hashlib
 import json
 import os
+import pickle
 import subprocess
 import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
+from importlib.metadata import version as package_version
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple, cast
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
 
 # QR code generation library
 import qrcode  # type: ignore[import-not-found]
 
 # Image processing
+import numpy as np
 from PIL import Image
 from qrcode.constants import (  # type: ignore[import-not-found]
     ERROR_CORRECT_H,
@@ -33,6 +41,12 @@ from qrcode.constants import (  # type: ignore[import-not-found]
     ERROR_CORRECT_Q,
 )
 
+QRCODE_VERSION = package_version("qrcode")
+# Bump when the pickled reference cache entries change shape
+REFERENCE_CACHE_FORMAT = 2
+# Kept outside test_output/ so it is not uploaded with the CI artifacts
+REFERENCE_CACHE_DIR = Path(__file__).parent / ".ref_cache"
+
 # QR code scanning (for verification)
 try:
     from pyzbar.pyzbar import decode as pyzbar_decode  # type: ignore[import-not-found]
@@ -42,6 +56,26 @@ except ImportError:
     PYZBAR_AVAILABLE = False
     print("Warning: pyzbar not available, QR code scanning verification disabled")
 
+# Faster JSON for the matrices exchanged with Lune (optional)
+try:
+    import orjson  # type: ignore[import-not-found]
+except ImportError:
+    orjson = None
+
+
+def json_dumps(value: Any) -> str:
+    """Serialize a value to JSON, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_SERIALIZE_NUMPY).decode('utf-8')
+    return json.dumps(value)
+
+
+def json_loads(data: str) -> Any:
+    """Parse JSON, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
 
 @dataclass
 class TestCase:
@@ -66,6 +100,52 @@ class TestResult:
     scan_result: Optional[str] = None
 
 
+@functools.lru_cache(maxsize=None)
+def generate_reference_qr(data: str, ecl: str) -> Tuple[np.ndarray, int, int]:
+    """Generate a QR code using the reference Python library
+
+    The result only depends on the inputs and the qrcode version, so it is
+    memoized in memory and persisted under tests/.ref_cache across runs.
+    The returned matrix is shared between callers and therefore read-only.
+    """
+    key = f"{REFERENCE_CACHE_FORMAT}|{QRCODE_VERSION}|{data}|{ecl}".encode('utf-8')
+    cache_file = REFERENCE_CACHE_DIR / f"{hashlib.sha1(key).hexdigest()}.pkl"
+
+    if cache_file.exists():
+        try:
+            with open(cache_file, 'rb') as f:
+                matrix, version, size = pickle.load(f)
+            matrix.setflags(write=False)
+            return matrix, version, size
+        except Exception as e:
+            print(f"Warning: ignoring unreadable reference cache {cache_file}: {e}")
+
+    qr = qrcode.QRCode(
+        version=None,  # Auto-select
+        error_correction=QRCodeTester.ECL_MAP[ecl],
+        box_size=1,
+        border=0,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+
+    # Get the matrix
+    matrix = np.asarray(qr.modules, dtype=np.uint8)
+    matrix.setflags(write=False)
+    result = (matrix, qr.version, len(matrix))
+
+    try:
+        REFERENCE_CACHE_DIR.mkdir(exist_ok=True)
+        # Write to a temporary file first so concurrent runs never see a partial entry
+        with tempfile.NamedTemporaryFile(dir=REFERENCE_CACHE_DIR, delete=False) as f:
+            pickle.dump(result, f)
+        os.replace(f.name, cache_file)
+    except OSError as e:
+        print(f"Warning: could not write reference cache {cache_file}: {e}")
+
+    return result
+
+
 class QRCodeTester:
     """Main test runner for QR code library testing"""
 
@@ -76,101 +156,153 @@ class QRCodeTester:
         'H': ERROR_CORRECT_H,
     }
 
-    def __init__(self, lune_executable: str = "lune", verbose: bool = False):
+    def __init__(self, lune_executable: str = "lune", verbose: bool = False,
+                 parallel: Optional[int] = None, save_artifacts: bool = False,
+                 debug_artifacts: bool = False):
         self.lune_executable = lune_executable
         self.verbose = verbose
+        self.save_artifacts = save_artifacts
+        self.debug_artifacts = debug_artifacts
+        # Verification overlaps well in threads since PIL and pyzbar release the GIL in
+        # native code, and the Lune worker is idle by then, so use every core.
+        self.parallel = parallel if parallel is not None else (os.cpu_count() or 4)
+        if self.parallel < 1:
+            raise ValueError("parallel must be at least 1")
         self.script_dir = Path(__file__).parent
         self.test_output_dir = self.script_dir / "test_output"
         self.test_output_dir.mkdir(exist_ok=True)
+        # A single Lune process serves every test case, see run_lune_test
+        self._lune: "Optional[subprocess.Popen[str]]" = None
+        self._lune_lock = threading.Lock()
 
     def log(self, message: str):
         """Print a message if verbose mode is enabled"""
         if self.verbose:
             print(message)
 
-    def generate_reference_qr(self, data: str, ecl: str) -> Tuple[List[List[int]], int, int]:
+    def generate_reference_qr(self, data: str, ecl: str) -> Tuple[np.ndarray, int, int]:
         """Generate a QR code using the reference Python library"""
-        qr = qrcode.QRCode(
-            version=None,  # Auto-select
-            error_correction=self.ECL_MAP[ecl],
-            box_size=1,
-            border=0,
-        )
-        qr.add_data(data)
-        qr.make(fit=True)
+        return generate_reference_qr(data, ecl)
+
+    def _worker(self) -> "subprocess.Popen[str]":
+        """Get the shared Lune worker, (re)starting it if needed"""
+        if self._lune is None or self._lune.poll() is not None:
+            self._lune = subprocess.Popen(
+                [self.lune_executable, "run", str(self.script_dir / "runTest.luau"), "--worker"],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                text=True,
+                encoding='utf-8',
+                bufsize=1,
+                cwd=str(self.script_dir.parent)
+            )
+        return self._lune
+
+    def _discard_worker(self):
+        """Kill the shared Lune worker so the next test case starts a fresh one"""
+        if self._lune is None:
+            return
+
+        worker, self._lune = self._lune, None
+        worker.kill()
+        worker.wait()
+        for stream in (worker.stdin, worker.stdout):
+            try:
+                if stream is not None:
+                    stream.close()
+            except OSError:
+                pass
+
+    def close(self):
+        """Shut down the shared Lune worker"""
+        if self._lune is None:
+            return
+
+        worker, self._lune = self._lune, None
+        try:
+            if worker.stdin is not None:
+                worker.stdin.close()
+            worker.wait(timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            worker.kill()
+            worker.wait()
 
-        # Get the matrix
-        matrix = []
-        for row in qr.modules:
-            matrix.append([1 if cell else 0 for cell in row])
+    def __enter__(self) -> "QRCodeTester":
+        return self
 
-        return matrix, qr.version, len(matrix)
+    def __exit__(self, *exc_info):
+        self.close()
 
     def run_lune_test(self, test_case: TestCase) -> Optional[Dict[str, Any]]:
-        """Run the Lune test script and get the output"""
-        test_script = self.script_dir / "runTest.luau"
-
+        """Run a test case through the shared Lune worker and get the output"""
         # Prepare test input
         test_input = {
+            "name": test_case.name,
             "data": test_case.data,
             "errorCorrection": test_case.error_correction,
             "isBinary": test_case.is_binary,
             "binaryData": test_case.binary_data,
         }
 
-        input_file = self.test_output_dir / f"{test_case.name}_input.json"
-        output_file = self.test_output_dir / f"{test_case.name}_output.json"
-
-        with open(input_file, 'w') as f:
-            json.dump(test_input, f)
-
-        try:
-            result = subprocess.run(
-                [self.lune_executable, "run", str(test_script), str(input_file), str(output_file)],
-                capture_output=True,
-                text=True,
-                timeout=30,
-                cwd=str(self.script_dir.parent)
-            )
-
-            if result.returncode != 0:
-                self.log(f"Lune error: {result.stderr}")
+        request = json_dumps(test_input)
+
+        # The worker answers requests strictly in order, one line each
+        with self._lune_lock:
+            try:
+                worker = self._worker()
+                assert worker.stdin is not None and worker.stdout is not None
+
+                timer = threading.Timer(30, worker.kill)
+                timer.start()
+                try:
+                    worker.stdin.write(request + "\n")
+                    worker.stdin.flush()
+                    line = worker.stdout.readline()
+                finally:
+                    timer.cancel()
+            except Exception as e:
+                # Never hand a possibly broken worker to the next test case
+                self.log(f"Error running Lune on {test_case.name}: {e}")
+                self._discard_worker()
                 return None
 
-            if output_file.exists():
-                with open(output_file) as f:
-                    return json.load(f)
-            else:
-                self.log(f"Output file not created: {output_file}")
+            if not line:
+                # poll() can still report a dying worker as alive, so don't rely on it
+                self.log(f"Lune worker exited or timed out on {test_case.name}")
+                self._discard_worker()
                 return None
 
-        except subprocess.TimeoutExpired:
-            self.log("Lune execution timed out")
-            return None
-        except Exception as e:
-            self.log(f"Error running Lune: {e}")
-            return None
+        # Requests and responses only go over the pipe, keep a copy on disk when debugging
+        if self.debug_artifacts:
+            input_file = self.test_output_dir / f"{test_case.name}_input.json"
+            output_file = self.test_output_dir / f"{test_case.name}_output.json"
+            input_file.write_text(request, encoding='utf-8')
+            output_file.write_text(line, encoding='utf-8')
 
-    def matrix_to_image(self, matrix: List[List[int]], scale: int = 10, border: int = 4) -> Image.Image:
-        """Convert a QR code matrix to a PIL Image"""
-        size = len(matrix)
-        total_size = (size + border * 2) * scale
+        try:
+            return json_loads(line)
+        except json.JSONDecodeError as e:
+            self.log(f"Invalid Lune output: {e}")
+            return None
 
-        img = Image.new('RGB', (total_size, total_size), 'white')
-        pixels = cast(Any, img.load())
-        if pixels is None:
-            raise RuntimeError("Failed to access image pixels")
+    def _render_pixels(self, matrix: Sequence[Sequence[int]], scale: int, border: int) -> np.ndarray:
+        """Render a QR code matrix to a grayscale pixel array (0 = dark, 255 = light)"""
+        arr = np.asarray(matrix, dtype=bool)
+        # Upscale each module to a scale x scale block, then pad with the quiet zone
+        big = np.kron(~arr, np.ones((scale, scale), dtype=bool))
+        padded = np.pad(big, border * scale, constant_values=True)
+        return padded.astype(np.uint8) * 255
 
-        for y in range(size):
-            for x in range(size):
-                if matrix[y][x]:
-                    for dy in range(scale):
-                        for dx in range(scale):
-                            px = (border + x) * scale + dx
-                            py = (border + y) * scale + dy
-                            pixels[px, py] = (0, 0, 0)
+    def matrix_to_image(self, matrix: Sequence[Sequence[int]], scale: int = 10, border: int = 4) -> Image.Image:
+        """Convert a QR code matrix to a PIL Image"""
+        pixels = self._render_pixels(matrix, scale, border)
+        return Image.fromarray(np.stack([pixels] * 3, axis=-1), 'RGB')
 
-        return img
+    def _scan_image(self, matrix: Sequence[Sequence[int]]) -> Image.Image:
+        """Convert a QR code matrix to the smallest image pyzbar reliably scans"""
+        # Single channel so pyzbar does not need to convert it. The quiet zone is kept at
+        # the 4 modules the spec asks for, it is only a small share of the pixels.
+        return Image.fromarray(self._render_pixels(matrix, scale=3, border=4), 'L')
 
     def scan_qr_code(self, image: Image.Image) -> Optional[str]:
         """Scan a QR code image and return the decoded data"""
@@ -185,30 +317,27 @@ class QRCodeTester:
             self.log(f"Scan error: {e}")
         return None
 
-    def compare_matrices(self, matrix1: List[List[int]], matrix2: List[List[int]]) -> float:
+    def compare_matrices(self, matrix1: Sequence[Sequence[int]], matrix2: Sequence[Sequence[int]]) -> float:
         """Compare two QR code matrices and return similarity (0-1)"""
-        if len(matrix1) != len(matrix2):
+        try:
+            a = np.asarray(matrix1, dtype=np.int8)
+            b = np.asarray(matrix2, dtype=np.int8)
+        except ValueError:
+            # Ragged rows
             return 0.0
 
-        if len(matrix1) == 0:
-            return 1.0
-
-        total = 0
-        matching = 0
-
-        for y in range(len(matrix1)):
-            if len(matrix1[y]) != len(matrix2[y]):
-                return 0.0
-            for x in range(len(matrix1[y])):
-                total += 1
-                if matrix1[y][x] == matrix2[y][x]:
-                    matching += 1
+        if a.shape != b.shape:
+            return 0.0
 
-        return matching / total if total > 0 else 0.0
+        return float((a == b).mean()) if a.size else 1.0
 
     def run_test(self, test_case: TestCase) -> TestResult:
         """Run a single test case"""
-        self.log(f"Running test: {test_case.name}")
+        return self.verify_test(test_case, self.run_lune_test(test_case))
+
+    def verify_test(self, test_case: TestCase, luau_output: Optional[Dict[str, Any]]) -> TestResult:
+        """Verify the Lune output of a single test case against the reference"""
+        self.log(f"Verifying test: {test_case.name}")
 
         # Generate reference QR code
         try:
@@ -222,9 +351,6 @@ class QRCodeTester:
                 message=f"Reference generation failed: {e}"
             )
 
-        # Run Lune test
-        luau_output = self.run_lune_test(test_case)
-
         if luau_output is None:
             return TestResult(
                 name=test_case.name,
@@ -239,10 +365,15 @@ class QRCodeTester:
 
         # Compare sizes
         if luau_size != ref_size:
+            message = f"Size mismatch: Luau={luau_size}, Reference={ref_size}"
+            if luau_output.get("success") is False:
+                message = f"Luau error: {luau_output.get('error')}. {message}"
+
+            self.write_artifacts(test_case, luau_output, ref_matrix)
             return TestResult(
                 name=test_case.name,
                 passed=False,
-                message=f"Size mismatch: Luau={luau_size}, Reference={ref_size}",
+                message=message,
                 luau_output=luau_output,
                 reference_output={"version": ref_version, "size": ref_size}
             )
@@ -250,19 +381,10 @@ class QRCodeTester:
         # Compare matrices
         similarity = self.compare_matrices(luau_matrix, ref_matrix)
 
-        # Generate image and scan
+        # Scan a small in-memory render, the full size image is only built for artifacts
         scan_result = None
         if luau_matrix:
-            img = self.matrix_to_image(luau_matrix)
-            img_path = self.test_output_dir / f"{test_case.name}_luau.png"
-            img.save(img_path)
-            scan_result = self.scan_qr_code(img)
-
-        # Save reference image too
-        if ref_matrix:
-            ref_img = self.matrix_to_image(ref_matrix)
-            ref_img_path = self.test_output_dir / f"{test_case.name}_reference.png"
-            ref_img.save(ref_img_path)
+            scan_result = self.scan_qr_code(self._scan_image(luau_matrix))
 
         # Determine pass/fail
         # We consider the test passed if:
@@ -290,6 +412,10 @@ class QRCodeTester:
             passed = False
             message = f"Low similarity: {similarity:.2%}"
 
+        # Artifacts are only needed for debugging, so skip the encode cost on the happy path
+        if self.save_artifacts or not passed:
+            self.write_artifacts(test_case, luau_output, ref_matrix)
+
         return TestResult(
             name=test_case.name,
             passed=passed,
@@ -300,6 +426,26 @@ class QRCodeTester:
             scan_result=scan_result
         )
 
+    def write_artifacts(self, test_case: TestCase, luau_output: Dict[str, Any],
+                        ref_matrix: np.ndarray):
+        """Save the Luau and reference images (and the Luau SVG) of a test case"""
+        luau_matrix = luau_output.get("matrix")
+        if luau_matrix:
+            img = self.matrix_to_image(luau_matrix)
+            img_path = self.test_output_dir / f"{test_case.name}_luau.png"
+            img.save(img_path)
+
+        # Save reference image too
+        if ref_matrix.size:
+            ref_img = self.matrix_to_image(ref_matrix)
+            ref_img_path = self.test_output_dir / f"{test_case.name}_reference.png"
+            ref_img.save(ref_img_path)
+
+        svg = luau_output.get("svg")
+        if svg:
+            svg_path = self.test_output_dir / f"{test_case.name}_luau.svg"
+            svg_path.write_text(svg, encoding='utf-8')
+
     def get_test_cases(self) -> List[TestCase]:
         """Get the list of test cases to run"""
         return [
@@ -344,18 +490,25 @@ class QRCodeTester:
             TestCase("numbers_alpha", "ABC123DEF456", "M"),
         ]
 
-    def run_all_tests(self, test_filter: Optional[str] = None) -> List[TestResult]:
-        """Run all test cases or a filtered subset"""
+    def run_all_tests(self, test_filter: Union[str, Sequence[str], None] = None,
+                      test_names: Optional[Sequence[str]] = None) -> List[TestResult]:
+        """Run all test cases, or the subset matching any of the given patterns and/or names"""
         test_cases = self.get_test_cases()
 
         if test_filter:
-            test_cases = [tc for tc in test_cases if test_filter in tc.name]
+            patterns = [test_filter] if isinstance(test_filter, str) else test_filter
+            test_cases = [tc for tc in test_cases if any(p in tc.name for p in patterns)]
+
+        if test_names:
+            test_cases = [tc for tc in test_cases if tc.name in test_names]
 
-        results = []
-        for tc in test_cases:
-            result = self.run_test(tc)
-            results.append(result)
+        # Generate every QR code with one Lune process, then verify the outputs concurrently.
+        # Results are collected before printing so output stays in manifest order.
+        luau_outputs = [self.run_lune_test(tc) for tc in test_cases]
+        with ThreadPoolExecutor(max_workers=self.parallel) as executor:
+            results = list(executor.map(self.verify_test, test_cases, luau_outputs))
 
+        for result in results:
             status = "[PASS]" if result.passed else "[FAIL]"
             print(f"{status}: {result.name} - {result.message}")
 
@@ -380,13 +533,29 @@ class QRCodeTester:
 def main():
     parser = argparse.ArgumentParser(description="QR Code Test Suite for luau-qrgen")
     parser.add_argument("--verbose", "-v", action="store_true", help="Enable verbose output")
-    parser.add_argument("--test-case", "-t", type=str, help="Run only tests matching this pattern")
+    parser.add_argument("--test-case", "-t", type=str, nargs="+",
+                        help="Run only tests matching any of these patterns")
+    parser.add_argument("--test-name", "-n", type=str, nargs="+",
+                        help="Run only tests with exactly these names")
     parser.add_argument("--lune", type=str, default="lune", help="Path to Lune executable")
+    parser.add_argument("--parallel", "-j", type=int, default=None,
+                        help="Number of test cases to verify concurrently, at least 1 (default: CPU count)")
+    parser.add_argument("--save-artifacts", action="store_true",
+                        help="Save images and SVGs for every test case, not just failing ones")
+    parser.add_argument("--debug-artifacts", action="store_true",
+                        help="Also save the JSON exchanged with Lune for every test case")
     args = parser.parse_args()
+    if args.parallel is not None and args.parallel < 1:
+        parser.error("--parallel must be at least 1")
     
-    tester = QRCodeTester(lune_executable=args.lune, verbose=args.verbose)
-    results = tester.run_all_tests(args.test_case)
-    tester.print_summary(results)
+    with QRCodeTester(lune_executable=args.lune, verbose=args.verbose, parallel=args.parallel,
+                      save_artifacts=args.save_artifacts, debug_artifacts=args.debug_artifacts) as tester:
+        results = tester.run_all_tests(args.test_case, args.test_name)
+        if not results:
+            # A stale or mistyped selection must not be reported as a green run
+            print("Error: no test cases match the given --test-case/--test-name selection")
+            sys.exit(1)
+        tester.print_summary(results)
     
     # Exit with error code if any tests failed
     sys.exit(0 if all(r.passed for r in results) else 1)